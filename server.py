@@ -1,21 +1,37 @@
+import asyncio
+import atexit
+import errno
 import io
 import os
-import base64
-import difflib
-import mimetypes
+import functools
+import math
+import queue
+import re
+import selectors
+import shlex
 import sys
-import datetime
 import subprocess
 import shutil
-from contextlib import redirect_stdout, redirect_stderr
+import stat
+import threading
+import time
 from mcp.server.fastmcp import FastMCP
 from mcp.server.fastmcp.utilities.types import Image
+from PIL import Image as PILImage, ImageChops, ImageStat
 from pathlib import Path
-from typing import Dict, List, Optional, Union, Annotated
+from typing import Dict, List, Optional, Tuple, Union, Annotated
 from pydantic import Field
 
+_IS_WIN = sys.platform == "win32"
+# Path of the activate script inside a virtual environment
+_ACTIVATE_PARTS = ("Scripts", "activate.bat") if _IS_WIN else ("bin", "activate")
+
 # Get configuration from environment variables with defaults
 WORKDIR = os.environ.get("WORKDIR", str(Path.home()))
+# WORKDIR with symlinks resolved, alone and as the prefix of the paths inside
+# it, to check that paths stay inside it
+_WORKDIR_REAL = os.path.realpath(WORKDIR)
+_WORKDIR_PREFIX = os.path.join(_WORKDIR_REAL, "")
 HOST = os.environ.get("HOST", "127.0.0.1")
 PORT = int(os.environ.get("PORT", 8000))
 
@@ -23,23 +39,106 @@ PORT = int(os.environ.get("PORT", 8000))
 # Use lower() to handle case-insensitivity
 LOG_COMMANDS = os.environ.get("MCP_LOG_COMMANDS", "0").lower() in ("1", "true", "yes")
 
-def log_command(command_type, command_data, result_success=None):
-    """Log command execution to stdout if logging is enabled
+# Maximum number of bytes of output captured from a shell command; commands
+# producing more are killed
+SHELL_OUTPUT_LIMIT = int(os.environ.get("MCP_SHELL_OUTPUT_LIMIT", 8 * 1024 * 1024))
+# Bytes read from a command's output pipes at a time
+_PIPE_CHUNK = 65536
+# Maximum number of shell commands running at once; each one occupies a
+# worker thread until it exits
+MAX_CONCURRENT_SHELLS = int(os.environ.get("MCP_MAX_CONCURRENT_SHELLS", 8))
+
+# Images larger than this (in bytes) are re-encoded as JPEG before being returned
+IMAGE_COMPRESS_THRESHOLD = 1000000
+# Largest dimension of a re-encoded image
+IMAGE_MAX_DIM = 2048
+# Approximate size aimed for when re-encoding, used to pick the output dimensions
+IMAGE_TARGET_BYTES = 512 * 1024
+# Rough JPEG output rate at quality 75 with 4:2:0 chroma subsampling
+_JPEG_BYTES_PER_PIXEL = 0.25
+# JPEG qualities tried when re-encoding, smallest output first; the last one
+# is kept when none reaches IMAGE_MIN_PSNR
+_JPEG_QUALITIES = (65, 75, 85)
+# Lowest PSNR (dB) against the downsampled image accepted for a re-encode
+IMAGE_MIN_PSNR = float(os.environ.get("MCP_IMAGE_MIN_PSNR", 35.0))
+
+# Log records waiting to be written by the log writer thread
+_log_queue = queue.SimpleQueue()
+
+def _log_command(command_type, command_data, *args, result_success=None):
+    """Log command execution to stdout
+
+    The record is only queued here; formatting and the write to stdout happen
+    in the log writer thread, so tool calls never block on stdout.
 
     Args:
         command_type (str): Type of command (e.g., 'shell', 'python')
-        command_data (str): The actual command that was executed
+        command_data (str): The actual command that was executed, as a
+            %-style template when args are given
+        *args: Values substituted into command_data when the record is written
         result_success (bool, optional): Whether the command was successful
     """
-    if LOG_COMMANDS:
-        timestamp = datetime.datetime.now().isoformat()
+    _log_queue.put_nowait((time.time_ns(), command_type, command_data, args, result_success))
+
+def _log_nothing(command_type, command_data, *args, result_success=None):
+    """Stand-in for _log_command when logging is disabled"""
+
+# Chosen once at startup, so that calls made with logging disabled do not
+# even test the flag
+log_command = _log_command if LOG_COMMANDS else _log_nothing
+
+# (second, "YYYY-MM-DDTHH:MM:SS" local time) of the last written record: the
+# records of a batch mostly fall within the same second
+_log_second = (None, "")
+
+def _write_log_batch(block=True):
+    """Write all queued log records to stdout with a single write and flush
+
+    Args:
+        block (bool): Wait for at least one record if the queue is empty
+    """
+    batch = []
+    try:
+        batch.append(_log_queue.get(block=block))
+        while True:
+            batch.append(_log_queue.get_nowait())
+    except queue.Empty:
+        pass
+    if not batch:
+        return
+
+    global _log_second
+    lines = []
+    for timestamp, command_type, command_data, args, result_success in batch:
+        # Same ISO 8601 local time as datetime.isoformat(), without building
+        # datetime objects; strftime only runs when the second changes
+        second, nanoseconds = divmod(timestamp, 1_000_000_000)
+        if _log_second[0] != second:
+            _log_second = (second, time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(second)))
+        iso_time = f"{_log_second[1]}.{nanoseconds // 1000:06d}"
         status = f"[{'SUCCESS' if result_success else 'FAILED'}]" if result_success is not None else ""
-        print(f"[{timestamp}] [MCP-LOG] [{command_type}] {status} {command_data}", file=sys.stdout)
-        sys.stdout.flush()  # Ensure logs are flushed immediately
+        if args:
+            command_data = command_data % args
+        lines.append(f"[{iso_time}] [MCP-LOG] [{command_type}] {status} {command_data}\n")
+    sys.stdout.write("".join(lines))
+    sys.stdout.flush()
+
+def _log_writer():
+    """Background loop draining the log queue"""
+    while True:
+        _write_log_batch()
+
+if LOG_COMMANDS:
+    threading.Thread(target=_log_writer, name="log-writer", daemon=True).start()
+    # The writer is a daemon thread: write what is still queued on exit
+    atexit.register(_write_log_batch, False)
 
 # Create an MCP server with environment variable configuration
 mcp = FastMCP("shell", stateless_http=True, host=HOST, port=PORT, path="/shell")
 
+# (WORKDIR mtime in ns, project names) from the last list_projects scan
+_projects_cache = (None, [])
+
 @mcp.resource("projects://")
 def list_projects() -> List[str]:
     """
@@ -48,9 +147,31 @@ def list_projects() -> List[str]:
     Returns:
         List[str]: A list of directory names in the workdir.
     """
+    global _projects_cache
     log_command("resource", "list_projects")
-    return [item for item in os.listdir(WORKDIR)
-            if os.path.isdir(os.path.join(WORKDIR, item))]
+
+    # Adding, removing or renaming a project updates the WORKDIR mtime, so
+    # the previous listing is reused as long as it is unchanged
+    mtime = os.stat(WORKDIR).st_mtime_ns
+    if _projects_cache[0] == mtime:
+        return list(_projects_cache[1])
+
+    # DirEntry.is_dir() relies on the d_type returned with the listing and
+    # only needs an extra stat for symlinks
+    with os.scandir(WORKDIR) as entries:
+        projects = [entry.name for entry in entries if entry.is_dir()]
+    _projects_cache = (mtime, projects)
+    return list(projects)
+
+# Name returned by get_active_project, None until computed. The server only
+# changes directory through _chdir, which resets it.
+_active_project_cache = None
+
+def _chdir(path: str):
+    """Change the working directory and forget the cached active project"""
+    global _active_project_cache
+    os.chdir(path)
+    _active_project_cache = None
 
 @mcp.resource("active-project://")
 def get_active_project() -> str:
@@ -60,10 +181,20 @@ def get_active_project() -> str:
     Returns:
         str: The name of the active project or a message indicating no active project.
     """
+    global _active_project_cache
     log_command("resource", "get_active_project")
-    if os.getcwd() == WORKDIR:
-        return "No active project"
-    return os.path.basename(os.getcwd())  # Using basename instead of split[-1]
+    if _active_project_cache is None:
+        current_dir = os.getcwd()
+        if current_dir == WORKDIR:
+            _active_project_cache = "No active project"
+        else:
+            _active_project_cache = os.path.basename(current_dir)  # Using basename instead of split[-1]
+    return _active_project_cache
+
+def _within_workdir(path: str) -> bool:
+    """Check that a path lies inside WORKDIR once symlinks and '..' are resolved"""
+    resolved = os.path.realpath(path)
+    return resolved == _WORKDIR_REAL or resolved.startswith(_WORKDIR_PREFIX)
 
 @mcp.tool()
 def cd(directory: str) -> dict:
@@ -80,38 +211,27 @@ def cd(directory: str) -> dict:
             - current_directory (str): The current directory path
             - error (str, optional): Error details (if unsuccessful)
     """
-    log_command("cd", f"directory={directory}")
-
     # Get the current directory before any changes
     current_dir = os.getcwd()
 
     try:
-        # Handle absolute paths
-        if os.path.isabs(directory):
-            target_path = directory
-            # Ensure the path is within WORKDIR for security
-            if not target_path.startswith(WORKDIR):
-                result = {
-                    "success": False,
-                    "message": f"Please provide either a relative path or a path in {WORKDIR}",
-                    "current_directory": current_dir,
-                    "error": "Unauthorized Path"
-                }
-                log_command("cd", f"directory={directory}", False)
-                return result
-        else:
-            # Handle relative paths by resolving against current directory
-            target_path = os.path.abspath(os.path.join(current_dir, directory))
-            # Ensure the path is within WORKDIR for security
-            if not target_path.startswith(WORKDIR):
-                result = {
-                    "success": False,
-                    "message": f"The resulting path would be outside {WORKDIR}",
-                    "current_directory": current_dir,
-                    "error": "Unauthorized Path"
-                }
-                log_command("cd", f"directory={directory}", False)
-                return result
+        # Handle relative paths by resolving against current directory
+        # current_dir is absolute, so joining leaves an absolute directory
+        # untouched and normpath is all abspath would add
+        is_absolute = os.path.isabs(directory)
+        target_path = os.path.normpath(os.path.join(current_dir, directory))
+
+        # Ensure the path is within WORKDIR for security
+        if not _within_workdir(target_path):
+            result = {
+                "success": False,
+                "message": (f"Please provide either a relative path or a path in {WORKDIR}" if is_absolute
+                            else f"The resulting path would be outside {WORKDIR}"),
+                "current_directory": current_dir,
+                "error": "Unauthorized Path"
+            }
+            log_command("cd", "directory=%s", directory, result_success=False)
+            return result
 
         # Check if directory exists
         if not os.path.isdir(target_path):
@@ -121,17 +241,17 @@ def cd(directory: str) -> dict:
                 "current_directory": current_dir,
                 "error": "FileNotFoundError"
             }
-            log_command("cd", f"directory={directory}", False)
+            log_command("cd", "directory=%s", directory, result_success=False)
             return result
 
         # Change to the directory
-        os.chdir(target_path)
+        _chdir(target_path)
         result = {
             "success": True,
             "message": f"Successfully changed to directory '{directory}'",
             "current_directory": target_path
         }
-        log_command("cd", f"directory={directory}", True)
+        log_command("cd", "directory=%s", directory, result_success=True)
         return result
     except Exception as e:
         # Get the current directory again after the exception
@@ -143,9 +263,77 @@ def cd(directory: str) -> dict:
             "current_directory": current_dir,
             "error": str(e)
         }
-        log_command("cd", f"directory={directory}", False)
+        log_command("cd", "directory=%s", directory, result_success=False)
         return result
 
+# MIME type of the image formats get_image serves, by file extension. A plain
+# dict lookup avoids mimetypes, which loads the system tables on first use.
+_IMAGE_MIME_TYPES = {
+    ".avif": "image/avif",
+    ".bmp": "image/bmp",
+    ".gif": "image/gif",
+    ".heic": "image/heic",
+    ".ico": "image/vnd.microsoft.icon",
+    ".jpe": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".jpg": "image/jpeg",
+    ".png": "image/png",
+    ".svg": "image/svg+xml",
+    ".tif": "image/tiff",
+    ".tiff": "image/tiff",
+    ".webp": "image/webp",
+}
+
+def _target_dimension(width: int, height: int) -> int:
+    """
+    Pick the largest dimension of a re-encoded image.
+
+    Args:
+        width (int): Width of the source image
+        height (int): Height of the source image
+
+    Returns:
+        int: Largest dimension that keeps the JPEG output near IMAGE_TARGET_BYTES
+    """
+    scale = min(1.0, math.sqrt(IMAGE_TARGET_BYTES / _JPEG_BYTES_PER_PIXEL / (width * height)))
+    return max(1, min(IMAGE_MAX_DIM, int(max(width, height) * scale)))
+
+def _psnr(original: PILImage.Image, encoded: bytes) -> float:
+    """
+    Measure how close a JPEG encoding stays to the image it was made from.
+
+    Args:
+        original (PILImage.Image): The RGB image that was encoded
+        encoded (bytes): The JPEG data
+
+    Returns:
+        float: Peak signal-to-noise ratio in dB, averaged over the bands
+    """
+    decoded = PILImage.open(io.BytesIO(encoded))
+    squares = ImageStat.Stat(ImageChops.difference(original, decoded)).sum2
+    mse = sum(squares) / (len(squares) * original.width * original.height)
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+def _encode_jpeg(img: PILImage.Image) -> bytes:
+    """
+    Encode an RGB image as JPEG at the lowest quality that looks close enough.
+
+    Args:
+        img (PILImage.Image): The image to encode
+
+    Returns:
+        bytes: JPEG data at the first quality of _JPEG_QUALITIES reaching
+            IMAGE_MIN_PSNR, or at the highest one
+    """
+    for quality in _JPEG_QUALITIES:
+        buffer = io.BytesIO()
+        # Skip optimize: the extra Huffman pass doubles encode time for a
+        # few percent of size
+        img.save(buffer, format="JPEG", quality=quality, subsampling=2, progressive=True)
+        if _psnr(img, buffer.getbuffer()) >= IMAGE_MIN_PSNR:
+            break
+    return buffer.getvalue()
+
 @mcp.tool()
 def get_image(
     path: Annotated[str, Field(description="Path to the image file. If relative, resolves from current directory")]
@@ -159,46 +347,54 @@ def get_image(
     # Convert relative path to absolute path
     abs_path = os.path.abspath(path)
 
-    # Check if the path exists
-    if not os.path.exists(abs_path):
+    # Check if the path exists, with a single stat reused below
+    try:
+        path_stat = os.stat(abs_path)
+    except OSError:
         return {"success": False, "error": f"Path '{path}' not found"}
 
     # Check if it's a file
-    if not os.path.isfile(abs_path):
+    if not stat.S_ISREG(path_stat.st_mode):
         return {"success": False, "error": f"Path '{path}' is not a file"}
 
     try:
         # Get file size in bytes
-        file_size = os.path.getsize(abs_path)
+        file_size = path_stat.st_size
 
         # Get the MIME type
-        mime_type, _ = mimetypes.guess_type(abs_path)
-        if not mime_type or not mime_type.startswith('image/'):
+        mime_type = _IMAGE_MIME_TYPES.get(os.path.splitext(abs_path)[1].lower())
+        if not mime_type:
             return {"success": False, "error": f"File '{path}' is not a recognized image format"}
 
         # If file is larger than ~1MB, compress it
-        if file_size > 1000000:
-            buffer = io.BytesIO()
+        if file_size > IMAGE_COMPRESS_THRESHOLD:
+            img = PILImage.open(abs_path)
+            max_dim = _target_dimension(*img.size)
 
-            # Open and compress the image
-            img = Image.open(abs_path)
-            img.convert("RGB").save(buffer, format="JPEG", quality=60, optimize=True)
+            # Let libjpeg decode at a reduced scale (1/2, 1/4 or 1/8) when the
+            # source is a JPEG, instead of materializing the full resolution
+            img.draft("RGB", (max_dim, max_dim))
 
-            # Use the compressed data
-            img_data = buffer.getvalue()
+            # A drafted JPEG already decodes to RGB: only convert other modes,
+            # sparing a full pass over the pixels in the common case
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+
+            # Downsample before encoding: the number of DCT blocks drops with
+            # the square of the scale
+            img.thumbnail((max_dim, max_dim), PILImage.Resampling.LANCZOS)
+
+            # Use the compressed data, at a quality picked for this image
+            img_data = _encode_jpeg(img)
             mime_type = "image/jpeg"  # Update mime type since we converted to JPEG
         else:
             # For smaller images, just read the file directly
             with open(abs_path, 'rb') as img_file:
                 img_data = img_file.read()
 
-        # Encode the image as base64
-        img_base64 = base64.b64encode(img_data).decode('utf-8')
-
-        # Determine format from the file extension
-        format = os.path.splitext(abs_path)[1].lower().lstrip('.')
-        if format in ('jpg', 'jpeg'):
-            format = 'jpeg'
+        # Determine format from the MIME type (Image turns it back into
+        # image/<format>), which is JPEG for re-encoded images
+        format = mime_type.split('/', 1)[1]
 
         # Return the Image object directly
         return Image(data=img_data, format=format)
@@ -207,162 +403,365 @@ def get_image(
         return {"success": False, "error": str(e)}
 
 
+# Common virtual environment directory names, with the path of the activate
+# script that marks a valid venv, relative to the project directory
+_VENV_ACTIVATE_PATHS = [
+    (venv_name, os.path.join(venv_name, *_ACTIVATE_PARTS))
+    for venv_name in ["venv", ".venv", "env", ".env", "virtualenv"]
+]
+_VENV_NAMES = frozenset(venv_name for venv_name, _ in _VENV_ACTIVATE_PATHS)
+
 # Helper function to detect virtual environments
-def detect_venv() -> str:
+def detect_venv(current_dir: Optional[str] = None) -> str:
     """
     Detect if a Python virtual environment exists in the current directory.
 
+    Args:
+        current_dir (str, optional): Directory to search instead of the current directory
+
     Returns:
         str: Path to the virtual environment if found, empty string otherwise
     """
+    if current_dir is None:
+        current_dir = os.getcwd()
 
-    # Common virtual environment directory names
-    venv_names = ["venv", ".venv", "env", ".env", "virtualenv"]
+    # The venv this server runs in, when it lives in the current directory,
+    # is known without touching the filesystem
+    active_venv = os.environ.get("VIRTUAL_ENV")
+    if active_venv and os.path.dirname(os.path.normpath(active_venv)) == current_dir:
+        return active_venv
 
-    # Check current directory for common venv folders
-    current_dir = os.getcwd()
-    for venv_name in venv_names:
-        venv_path = os.path.join(current_dir, venv_name)
-        if os.path.isdir(venv_path):
-            # Verify it's a valid venv by checking for activate script
-            is_windows = sys.platform == "win32"
-            if is_windows:
-                activate_path = os.path.join(venv_path, "Scripts", "activate.bat")
-            else:
-                activate_path = os.path.join(venv_path, "bin", "activate")
-            if os.path.exists(activate_path):
-                return venv_path
+    try:
+        # Creating or removing a venv folder updates the directory mtime,
+        # which invalidates the cached list of candidate folders
+        mtime = os.stat(current_dir).st_mtime_ns
+    except OSError:
+        return ""
+
+    # The activate scripts are checked on every call: a venv can be created
+    # inside a folder that already exists without touching the directory
+    for venv_name, activate_path in _venv_candidates(current_dir, mtime):
+        if os.path.exists(os.path.join(current_dir, activate_path)):
+            return os.path.join(current_dir, venv_name)
 
     # No valid venv found
     return ""
 
-def shell_exec_with_venv(venv_path: str, command: str) -> Dict[str, Union[str, bool]]:
+@functools.lru_cache(maxsize=128)
+def _venv_candidates(current_dir: str, mtime_ns: int) -> Tuple[Tuple[str, str], ...]:
     """
-    Execute a shell command within an activated Python virtual environment.
+    List the folders of a directory that may hold a virtual environment, once per directory state.
+
+    Args:
+        current_dir (str): Directory to search
+        mtime_ns (int): Modification time of the directory, part of the cache key
+
+    Returns:
+        Tuple[Tuple[str, str], ...]: The (venv name, activate script path) entries of
+            _VENV_ACTIVATE_PATHS whose folder exists, in the same order
+    """
+    # One directory read tells which candidate folders exist
+    try:
+        with os.scandir(current_dir) as entries:
+            present = {entry.name for entry in entries
+                       if entry.name in _VENV_NAMES and entry.is_dir()}
+    except OSError:
+        return ()
+    return tuple(candidate for candidate in _VENV_ACTIVATE_PATHS if candidate[0] in present)
+
+# Shell used for commands that need one: bash where available, so that
+# bash syntax works as expected; None keeps the platform default
+_SHELL_EXECUTABLE = None if _IS_WIN else shutil.which("bash")
+
+# Characters that need a shell to interpret the command: operators,
+# redirections, expansions, globs, escapes and comments
+_SHELL_SYNTAX = re.compile(r"[;&|<>()$`\\*?\[\]{}~#!\n]")
+
+# Reserved words and builtins that some systems also ship as programs, with
+# a different behaviour (e.g. /usr/bin/time): these always go through bash
+_SHELL_KEYWORDS = frozenset([
+    "case", "coproc", "do", "done", "elif", "else", "esac", "fi", "for", "function",
+    "if", "in", "select", "then", "time", "until", "while",
+    "alias", "bg", "cd", "command", "fc", "fg", "getopts", "hash", "jobs", "kill",
+    "pwd", "read", "type", "ulimit", "umask", "unalias", "wait",
+])
+
+def _command_args(command: str, env: Optional[Dict[str, str]] = None,
+                  cwd: Optional[str] = None) -> Optional[List[str]]:
+    """
+    Split a command that can be executed directly, without a shell.
+
+    Args:
+        command (str): The shell command line
+        env (dict, optional): Environment the command will run with, used to look up the executable
+        cwd (str, optional): Directory the command will run in, used to resolve a relative executable
+
+    Returns:
+        Optional[List[str]]: The argument list, or None if the command needs a shell
+            (shell syntax, a shell keyword, or a builtin such as export that is not on PATH)
+    """
+    if _IS_WIN or _SHELL_SYNTAX.search(command):
+        return None
+    try:
+        args = shlex.split(command)
+    except ValueError:
+        return None
+    if not args or args[0] in _SHELL_KEYWORDS:
+        return None
+    # A relative path such as ./script.sh is looked up from the directory the
+    # command runs in, not from the server's current directory
+    program = os.path.join(cwd, args[0]) if cwd and os.sep in args[0] else args[0]
+    if shutil.which(program, path=(env or os.environ).get("PATH")) is None:
+        return None
+    return args
+
+def _popen(command: Union[str, List[str]], env: Optional[Dict[str, str]] = None,
+           cwd: Optional[str] = None) -> subprocess.Popen:
+    """Start a command with piped output, skipping the shell when it is not needed"""
+    options = dict(
+        # Commands waiting on stdin would otherwise hang the tool call
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=env,
+        cwd=cwd
+    )
+    if isinstance(command, list):
+        return subprocess.Popen(command, **options)
+
+    args = _command_args(command, env, cwd)
+    if args is not None:
+        try:
+            return subprocess.Popen(args, **options)
+        except OSError as e:
+            # An executable script without a #! line cannot be exec'd, but
+            # bash runs it as a shell script: leave it to the shell
+            if e.errno != errno.ENOEXEC:
+                raise
+    return subprocess.Popen(command, shell=True, executable=_SHELL_EXECUTABLE, **options)
+
+def _collect_output(process: subprocess.Popen) -> Tuple[str, str]:
+    """
+    Read a process's output until it exits, capped at SHELL_OUTPUT_LIMIT bytes.
+
+    Output is read in pipe-sized chunks into bytearrays and decoded once. A
+    process producing more than the limit is killed and a note is added to
+    stderr.
+
+    Args:
+        process (subprocess.Popen): Process started by _popen
+
+    Returns:
+        Tuple[str, str]: The decoded stdout and stderr
+    """
+    if _IS_WIN:
+        # selectors cannot wait on pipes on Windows
+        stdout, stderr = process.communicate()
+        truncated = False
+    else:
+        buffers = {process.stdout: bytearray(), process.stderr: bytearray()}
+        total = 0
+        truncated = False
+        with selectors.DefaultSelector() as selector:
+            for pipe in buffers:
+                selector.register(pipe, selectors.EVENT_READ)
+            while selector.get_map() and not truncated:
+                for key, _ in selector.select():
+                    chunk = os.read(key.fd, _PIPE_CHUNK)
+                    if not chunk:
+                        selector.unregister(key.fileobj)
+                        continue
+                    buffers[key.fileobj] += chunk
+                    total += len(chunk)
+                truncated = total > SHELL_OUTPUT_LIMIT
+        if truncated:
+            process.kill()
+        process.stdout.close()
+        process.stderr.close()
+        process.wait()
+        stdout, stderr = buffers[process.stdout], buffers[process.stderr]
+
+    # Same newline translation as reading the pipes in text mode
+    stdout, stderr = (data.decode('utf-8', errors='replace').replace('\r\n', '\n').replace('\r', '\n')
+                      for data in (stdout, stderr))
+    if truncated:
+        stderr += f"\n[Output exceeded {SHELL_OUTPUT_LIMIT} bytes, command was killed]"
+    return stdout, stderr
+
+def _run(command: Union[str, List[str]], env: Optional[Dict[str, str]] = None,
+         cwd: Optional[str] = None) -> Tuple[int, str, str]:
+    """
+    Run a command to completion and capture its output.
+
+    Shared by every tool that spawns processes. Python 3.10+ closes inherited
+    file descriptors in the child by walking /proc/self/fd or with
+    close_range(), so the default close_fds=True stays cheap whatever the
+    RLIMIT_NOFILE value.
+
+    Args:
+        command (Union[str, List[str]]): A shell command line, or an argument list executed directly
+        env (dict, optional): Environment to run the command with
+        cwd (str, optional): Directory to run the command in, instead of the current directory
+
+    Returns:
+        Tuple[int, str, str]: The exit code, stdout and stderr
+    """
+    process = _popen(command, env, cwd)
+    stdout, stderr = _collect_output(process)
+    return process.returncode, stdout, stderr
+
+_shell_slots = asyncio.Semaphore(MAX_CONCURRENT_SHELLS)
+
+async def _to_thread(func, *args):
+    """
+    Run a blocking helper in a worker thread, keeping the event loop free.
+
+    At most MAX_CONCURRENT_SHELLS helpers run at once; further calls wait
+    for a slot.
+
+    Args:
+        func (callable): The blocking function to run
+        *args: Arguments passed to func
+
+    Returns:
+        The return value of func
+    """
+    async with _shell_slots:
+        return await asyncio.to_thread(func, *args)
+
+# Environment set up by each venv's activate script, keyed by venv path
+_venv_environ_cache: Dict[str, Dict[str, str]] = {}
+
+def _venv_environ(venv_path: str, activate_script: str) -> Dict[str, str]:
+    """
+    Get the environment an activated virtual environment provides.
+
+    The activate script is sourced once per venv in a shell that dumps the
+    resulting environment; later commands reuse it without any shell.
 
     Args:
         venv_path (str): Path to the virtual environment directory
-        command (str): The shell command to execute in the activated environment
+        activate_script (str): Path to its activate script
 
     Returns:
-        Dict[str, Union[str, bool]]: Dictionary with stdout, stderr and execution status
+        Dict[str, str]: Environment variables to run commands with
+    """
+    env = _venv_environ_cache.get(venv_path)
+    if env is None:
+        if _IS_WIN:
+            output = subprocess.run(f'call "{activate_script}" && set', shell=True,
+                                    capture_output=True, text=True, check=True).stdout
+            pairs = output.splitlines()
+        else:
+            output = subprocess.run(["/bin/sh", "-c", '. "$1" && env -0', "sh", activate_script],
+                                    capture_output=True, text=True, check=True).stdout
+            pairs = output.split("\0")
+        env = dict(pair.split("=", 1) for pair in pairs if "=" in pair)
+        # Shell bookkeeping describing the capture shell, not later commands
+        for name in ("PWD", "OLDPWD", "SHLVL", "_"):
+            env.pop(name, None)
+        _venv_environ_cache[venv_path] = env
+    return env
+
+async def shell_exec_with_venv(venv_path: str, command: Union[str, List[str]],
+                               cwd: Optional[str] = None) -> Dict[str, Union[str, bool]]:
     """
-    log_command("venv_shell", f"venv_path=\"{venv_path}\", command=\"{command}\"")
+    Execute a shell command within an activated Python virtual environment.
 
+    Args:
+        venv_path (str): Path to the virtual environment directory
+        command (Union[str, List[str]]): The shell command to execute in the activated environment,
+            or an argument list executed without a shell
+        cwd (str, optional): Directory to run the command in. Defaults to the current directory
+            at the time of the call.
 
-    result = {
-        "stdout": "",
-        "stderr": "",
-        "success": True
-    }
+    Returns:
+        Dict[str, Union[str, bool]]: Dictionary with stdout, stderr and execution status
+    """
+    # Pinned before the first await: cd may change the process directory
+    # while the command waits for a worker thread
+    if cwd is None:
+        cwd = os.getcwd()
 
     # Validate the venv path
     if not os.path.isdir(venv_path):
-        result["success"] = False
-        result["stderr"] = f"Error: Virtual environment directory '{venv_path}' does not exist."
-        log_command("venv_shell", f"venv_path=\"{venv_path}\", command=\"{command}\"", False)
-        return result
+        log_command("venv_shell", 'venv_path="%s", command="%s"', venv_path, command, result_success=False)
+        return {
+            "stdout": "",
+            "stderr": f"Error: Virtual environment directory '{venv_path}' does not exist.",
+            "success": False
+        }
 
     # Check if it looks like a valid venv (has bin/activate or Scripts/activate.bat)
-    is_windows = sys.platform == "win32"
-    if is_windows:
-        activate_script = os.path.join(venv_path, "Scripts", "activate.bat")
-    else:
-        activate_script = os.path.join(venv_path, "bin", "activate")
+    activate_script = os.path.join(venv_path, *_ACTIVATE_PARTS)
 
     if not os.path.exists(activate_script):
-        result["success"] = False
-        result["stderr"] = f"Error: '{venv_path}' does not appear to be a valid virtual environment."
-        log_command("venv_shell", f"venv_path=\"{venv_path}\", command=\"{command}\"", False)
-        return result
+        log_command("venv_shell", 'venv_path="%s", command="%s"', venv_path, command, result_success=False)
+        return {
+            "stdout": "",
+            "stderr": f"Error: '{venv_path}' does not appear to be a valid virtual environment.",
+            "success": False
+        }
 
     try:
-        # Construct the activation command based on OS
-        if is_windows:
-            cmd = f'call "{activate_script}" && {command}'
-        else:  # Unix-like systems (Linux, macOS)
-            cmd = f'. "{activate_script}" && {command}'
-
-        # Run the command and capture output
-        process = subprocess.Popen(
-            cmd,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-
-        # Get output and error streams
-        stdout, stderr = process.communicate()
-
-        # Populate result
-        result["stdout"] = stdout
-        result["stderr"] = stderr
-        result["success"] = process.returncode == 0
-        log_command("venv_shell", f"venv_path=\"{venv_path}\", command=\"{command}\"", result["success"])
-
+        # Run the command with the environment activate produced, rather
+        # than sourcing the script through a shell on every call
+        env = await _to_thread(_venv_environ, venv_path, activate_script)
+        returncode, stdout, stderr = await _to_thread(_run, command, env, cwd)
     except Exception as e:
-        result["success"] = False
-        result["stderr"] = f"Error executing command in virtual environment: {str(e)}"
-        log_command("venv_shell", f"venv_path=\"{venv_path}\", command=\"{command}\"", False)
+        log_command("venv_shell", 'venv_path="%s", command="%s"', venv_path, command, result_success=False)
+        return {
+            "stdout": "",
+            "stderr": f"Error executing command in virtual environment: {str(e)}",
+            "success": False
+        }
 
-    return result
+    log_command("venv_shell", 'venv_path="%s", command="%s"', venv_path, command, result_success=returncode == 0)
+    return {"stdout": stdout, "stderr": stderr, "success": returncode == 0}
 
 @mcp.tool()
-def shell_exec(command: str, auto_env: bool = True) -> Dict[str, Union[str, bool]]:
+async def shell_exec(command: Union[str, List[str]], auto_env: bool = True) -> Dict[str, Union[str, bool]]:
     """
     Execute a shell command and return its output.
     Automatically uses virtual environment if detected and auto_env is True.
 
     Args:
-        command (str): The shell command to execute
+        command (Union[str, List[str]]): The shell command to execute, or an argument list
+            (e.g. ["python", "script.py"]) executed directly without a shell
         auto_env (bool, optional): Whether to automatically use detected environments. Defaults to True.
 
     Returns:
         Dict[str, Union[str, bool]]: Dictionary with stdout, stderr and execution status
     """
-    log_command("shell", f"command=\"{command}\", auto_env={auto_env}")
+    # Pinned before the first await: cd may change the process directory
+    # while the command waits for a worker thread
+    cwd = os.getcwd()
 
     # If auto_env is True, check for virtual environment
     if auto_env:
-        venv_path = detect_venv()
+        venv_path = detect_venv(cwd)
         if venv_path:
-            log_command("shell", f"Virtual environment detected at {venv_path}, using shell_exec_with_venv")
-            return shell_exec_with_venv(venv_path, command)
+            return await shell_exec_with_venv(venv_path, command, cwd)
 
     # Original shell_exec implementation
-
-    result = {
-        "stdout": "",
-        "stderr": "",
-        "success": True
-    }
-
     try:
-        # Run the command and capture output
-        process = subprocess.Popen(
-            command,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-
-        # Get output and error streams
-        stdout, stderr = process.communicate()
-
-        # Populate result
-        result["stdout"] = stdout
-        result["stderr"] = stderr
-        result["success"] = process.returncode == 0
-        log_command("shell", f"command=\"{command}\"", result["success"])
-
+        # Run the command and capture output, in a worker thread so that
+        # other tool calls are served meanwhile
+        returncode, stdout, stderr = await _to_thread(_run, command, None, cwd)
     except Exception as e:
-        result["success"] = False
-        result["stderr"] = f"Error executing command: {str(e)}"
-        log_command("shell", f"command=\"{command}\"", False)
+        log_command("shell", 'command="%s"', command, result_success=False)
+        return {
+            "stdout": "",
+            "stderr": f"Error executing command: {str(e)}",
+            "success": False
+        }
 
-    return result
+    log_command("shell", 'command="%s"', command, result_success=returncode == 0)
+    return {"stdout": stdout, "stderr": stderr, "success": returncode == 0}
+
+# Repository name in a git URL: the last segment after ":" (SSH, e.g.
+# git@host:user/repo.git) or "/" (HTTPS/file), without ".git" or trailing "/"s
+_REPO_NAME_RE = re.compile(r"(?:^|[:/])([^:/]*?)(?:\.git)?/*$")
 
 @mcp.tool()
 def clone_repo(
@@ -380,33 +779,26 @@ def clone_repo(
     - If directory doesn't exist: clone and cd into it.
     """
 
-    log_command("git_clone", f'url="{url}", reset={reset}')
-
     try:
         # Derive repo name - handle both SSH and HTTPS formats
-        if ":" in url and "@" in url and not url.startswith("http"):
-            # SSH format: git@host:path or git@host:user/repo
-            tail = url.split(":")[-1].split("/")[-1]
-        else:
-            # HTTPS/file format
-            tail = url.rstrip("/").split("/")[-1]
-        repo_name = tail[:-4] if tail.endswith(".git") else tail
+        match = _REPO_NAME_RE.search(url)
+        repo_name = match.group(1) if match else ""
 
         # Very light sanity check
         if not repo_name or repo_name in (".", "..") or os.sep in repo_name or (os.altsep and os.altsep in repo_name):
             msg = f"Invalid repository name derived from URL: '{repo_name}'"
-            log_command("git_clone", msg, False)
+            log_command("git_clone", 'url="%s", %s', url, msg, result_success=False)
             return {"success": False, "message": msg, "current_directory": os.getcwd()}
 
         # Work from root (WORKDIR)
-        os.chdir(WORKDIR)
+        _chdir(WORKDIR)
         target = os.path.join(WORKDIR, repo_name)
 
         # If it exists and we don’t want to reset: just switch to it
         if os.path.isdir(target) and not reset:
-            os.chdir(target)
+            _chdir(target)
             msg = f"Repository '{repo_name}' already exists. Switched to existing directory."
-            log_command("git_clone", msg, True)
+            log_command("git_clone", 'url="%s", %s', url, msg, result_success=True)
             return {"success": True, "message": msg, "current_directory": os.getcwd()}
 
         # If it exists and reset=True, remove it
@@ -415,7 +807,7 @@ def clone_repo(
                 shutil.rmtree(target)
             except Exception as e:
                 msg = f"Failed to remove '{target}': {e}"
-                log_command("git_clone", msg, False)
+                log_command("git_clone", 'url="%s", %s', url, msg, result_success=False)
                 return {"success": False, "message": msg, "current_directory": os.getcwd(), "stderr": str(e)}
 
         # always have an url which ends with .git (gitolite quirk fix)
@@ -425,36 +817,111 @@ def clone_repo(
         # Clone (either fresh or after reset)
         env = os.environ.copy()
         env['GIT_SSH_COMMAND'] = 'ssh -o StrictHostKeyChecking=no'
-        r = subprocess.run(["git", "clone", url, repo_name], capture_output=True, text=True, env=env)
-        if r.returncode != 0:
-            msg = f"git clone failed with exit code {r.returncode}"
-            log_command("git_clone", msg, False)
+        returncode, stdout, stderr = _run(["git", "clone", url, repo_name], env=env)
+        if returncode != 0:
+            msg = f"git clone failed with exit code {returncode}"
+            log_command("git_clone", 'url="%s", %s', url, msg, result_success=False)
             # Stay in WORKDIR on failure
             return {
                 "success": False,
                 "message": msg,
                 "current_directory": os.getcwd(),
-                "stdout": r.stdout,
-                "stderr": r.stderr,
+                "stdout": stdout,
+                "stderr": stderr,
             }
 
         # Switch to the cloned repo
-        os.chdir(target)
+        _chdir(target)
         msg = ("Existing directory was replaced. " if reset else "") + f"Cloned '{url}' into '{target}'."
-        log_command("git_clone", msg, True)
+        log_command("git_clone", 'url="%s", %s', url, msg, result_success=True)
         return {
             "success": True,
             "message": msg,
             "current_directory": os.getcwd(),
-            "stdout": r.stdout,
-            "stderr": r.stderr,
+            "stdout": stdout,
+            "stderr": stderr,
         }
 
     except Exception as e:
         msg = f"Unexpected error during clone: {e}"
-        log_command("git_clone", msg, False)
+        log_command("git_clone", 'url="%s", %s', url, msg, result_success=False)
         return {"success": False, "message": msg, "current_directory": os.getcwd(), "stderr": str(e)}
 
+def _split_lines(text: str) -> List[str]:
+    """Split text into lines the way a file opened in text mode would"""
+    return io.StringIO(text, newline=None).readlines()
+
+# Bisection in _newline_end stops once at most this many newlines remain or
+# the window is at most this many bytes, bounding the find() walk that follows
+_NEWLINE_WALK = 256
+
+def _newline_end(data: bytes, count: int, start: int = 0) -> int:
+    """
+    Find the offset just past a given newline without copying data.
+
+    Nearby newlines are walked with find(). Distant ones are located by
+    bisecting with bytes.count() over index ranges, so the search scans data
+    about once at C speed before walking the last few lines.
+
+    Args:
+        data (bytes): File content
+        count (int): Number of newlines to skip, at most the number after start
+        start (int): Offset to start counting from. Defaults to 0.
+
+    Returns:
+        int: Offset just past the count-th newline after start, start when count is 0
+    """
+    # The count-th newline lies in data[lo:hi], with seen newlines in data[start:lo]
+    lo, hi, seen = start, len(data), 0
+    while count - seen > _NEWLINE_WALK and hi - lo > _NEWLINE_WALK:
+        mid = (lo + hi) // 2
+        found = data.count(b'\n', lo, mid)
+        if seen + found >= count:
+            hi = mid
+        else:
+            lo, seen = mid, seen + found
+    pos = lo
+    for _ in range(count - seen):
+        pos = data.find(b'\n', pos) + 1
+    return pos
+
+def _read_lines(abs_path: str, start_line: int, end_line: Optional[int]) -> Tuple[int, str]:
+    """
+    Read a range of lines from a UTF-8 text file.
+
+    The file is read once as bytes and line boundaries are located with
+    C-level byte operations, so only the requested byte range is decoded.
+    Newlines are left untranslated in the returned text.
+
+    Args:
+        abs_path (str): Absolute path to the file
+        start_line (int): First line to return (1-based)
+        end_line (int, optional): Last line to return (inclusive). If None, reads to end of file.
+
+    Returns:
+        Tuple[int, str]: Total number of lines in the file and the text of the selected lines
+    """
+    # Read to EOF rather than trusting st_size, which is 0 for /proc files
+    with open(abs_path, 'rb') as f:
+        data = f.read()
+
+    # The whole file is decoded anyway, so count lines on the text directly
+    if start_line == 1 and end_line is None:
+        text = data.decode('utf-8')
+        return text.count('\n') + (not text.endswith('\n') if text else 0), text
+
+    total_lines = data.count(b'\n') + (not data.endswith(b'\n') if data else 0)
+    if start_line > total_lines:
+        return total_lines, ""
+
+    start = _newline_end(data, start_line - 1)
+    if end_line is None or end_line >= total_lines:
+        end = len(data)
+    else:
+        end = _newline_end(data, end_line - start_line + 1, start)
+
+    return total_lines, data[start:end].decode('utf-8')
+
 @mcp.tool()
 def read_file(
     file_path: str,
@@ -483,7 +950,9 @@ def read_file(
             - show_line_numbers (bool): Whether line numbers were included
             - error (str, optional): Error details (if unsuccessful)
     """
-    log_command("read_file", f"file_path='{file_path}', start_line={start_line}, end_line={end_line}, show_line_numbers={show_line_numbers}")
+    # Logged once, with the outcome, when the call returns
+    log_data = ("file_path='%s', start_line=%s, end_line=%s, show_line_numbers=%s",
+                file_path, start_line, end_line, show_line_numbers)
 
     # Convert relative path to absolute path
     abs_path = os.path.abspath(file_path)
@@ -503,35 +972,34 @@ def read_file(
     if start_line < 1:
         result["error"] = "start_line must be >= 1"
         result["message"] = f"Invalid start_line: {start_line}. Line numbers are 1-based."
-        log_command("read_file", f"file_path='{file_path}'", False)
+        log_command("read_file", *log_data, result_success=False)
         return result
 
     # Validate end_line if provided
     if end_line is not None and end_line < start_line:
         result["error"] = "end_line must be >= start_line"
         result["message"] = f"Invalid range: start_line={start_line}, end_line={end_line}"
-        log_command("read_file", f"file_path='{file_path}'", False)
+        log_command("read_file", *log_data, result_success=False)
         return result
 
-    # Check if file exists
-    if not os.path.exists(abs_path):
+    # Check that the file exists and is a regular file with a single stat
+    try:
+        st = os.stat(abs_path)
+    except OSError:
         result["error"] = "FileNotFoundError"
         result["message"] = f"File '{file_path}' does not exist"
-        log_command("read_file", f"file_path='{file_path}'", False)
+        log_command("read_file", *log_data, result_success=False)
         return result
 
     # Check if it's a file (not a directory)
-    if not os.path.isfile(abs_path):
+    if not stat.S_ISREG(st.st_mode):
         result["error"] = "NotAFileError"
         result["message"] = f"Path '{file_path}' is not a file"
-        log_command("read_file", f"file_path='{file_path}'", False)
+        log_command("read_file", *log_data, result_success=False)
         return result
 
     try:
-        with open(abs_path, 'r', encoding='utf-8') as f:
-            all_lines = f.readlines()
-
-        total_lines = len(all_lines)
+        total_lines, text = _read_lines(abs_path, start_line, end_line)
         result["total_lines"] = total_lines
 
         # Handle empty file
@@ -540,7 +1008,7 @@ def read_file(
             result["message"] = "File is empty"
             result["content"] = ""
             result["lines_read"] = 0
-            log_command("read_file", f"file_path='{file_path}'", True)
+            log_command("read_file", *log_data, result_success=True)
             return result
 
         # Adjust end_line if not specified or beyond file length
@@ -553,55 +1021,100 @@ def read_file(
             result["message"] = f"start_line ({start_line}) is beyond file length ({total_lines}). No lines returned."
             result["content"] = ""
             result["lines_read"] = 0
-            log_command("read_file", f"file_path='{file_path}'", True)
+            log_command("read_file", *log_data, result_success=True)
             return result
 
-        # Extract the requested lines (convert to 0-based indexing)
-        selected_lines = all_lines[start_line-1:actual_end_line]
+        lines_read = actual_end_line - start_line + 1
 
         # Generate content with or without line numbers
         if show_line_numbers:
-            numbered_lines = []
-            for i, line in enumerate(selected_lines, start=start_line):
-                # Format line numbers with consistent width for better alignment
-                line_num_width = len(str(actual_end_line))
-                numbered_lines.append(f"{i:>{line_num_width}}: {line}")
-            content = ''.join(numbered_lines)
+            # Format line numbers with consistent width for better alignment
+            line_num_width = len(str(actual_end_line))
+            lines = text.split('\n')[:lines_read]
+            content = '\n'.join(f"{i:>{line_num_width}}: {line}"
+                                for i, line in enumerate(lines, start=start_line))
+            if text.endswith('\n'):
+                content += '\n'
         else:
-            content = ''.join(selected_lines)
+            content = text
+
+        # Translate newlines the way a file opened in text mode would
+        if '\r' in content:
+            content = content.replace('\r\n', '\n').replace('\r', '\n')
 
         result["success"] = True
         result["content"] = content
-        result["lines_read"] = len(selected_lines)
+        result["lines_read"] = lines_read
 
         # Update message to indicate line numbering
         line_nums_msg = " (with line numbers)" if show_line_numbers else ""
         if start_line == 1 and actual_end_line == total_lines:
             result["message"] = f"Read entire file ({total_lines} lines){line_nums_msg}"
         else:
-            result["message"] = f"Read lines {start_line}-{actual_end_line} ({len(selected_lines)} lines) from file with {total_lines} total lines{line_nums_msg}"
+            result["message"] = f"Read lines {start_line}-{actual_end_line} ({lines_read} lines) from file with {total_lines} total lines{line_nums_msg}"
 
-        log_command("read_file", f"file_path='{file_path}'", True)
+        log_command("read_file", *log_data, result_success=True)
         return result
 
     except UnicodeDecodeError as e:
         result["error"] = "UnicodeDecodeError"
         result["message"] = f"Cannot read file '{file_path}' as UTF-8 text: {str(e)}"
-        log_command("read_file", f"file_path='{file_path}'", False)
+        log_command("read_file", *log_data, result_success=False)
         return result
 
     except PermissionError as e:
         result["error"] = "PermissionError"
         result["message"] = f"Permission denied reading file '{file_path}': {str(e)}"
-        log_command("read_file", f"file_path='{file_path}'", False)
+        log_command("read_file", *log_data, result_success=False)
         return result
 
     except Exception as e:
         result["error"] = str(e)
         result["message"] = f"Unexpected error reading file '{file_path}': {str(e)}"
-        log_command("read_file", f"file_path='{file_path}'", False)
+        log_command("read_file", *log_data, result_success=False)
         return result
 
+def _line_offsets(data: bytes, line_indexes: Tuple[int, ...]) -> List[int]:
+    """
+    Find the byte offsets at which the given lines start.
+
+    Args:
+        data (bytes): File content
+        line_indexes (tuple): 0-based line indexes, in ascending order
+
+    Returns:
+        List[int]: Offset of each line, or len(data) for lines past the end
+    """
+    offsets = []
+    pos = 0
+    line = 0
+    for target in line_indexes:
+        while line < target and pos < len(data):
+            pos = data.find(b'\n', pos) + 1 or len(data)
+            line += 1
+        offsets.append(pos)
+    return offsets
+
+def _hunk_header(start: int, old_count: int, new_count: int) -> str:
+    """
+    Format a unified diff hunk header the way difflib does.
+
+    Args:
+        start (int): 0-based index of the first line of the hunk
+        old_count (int): Number of lines the hunk covers before the change
+        new_count (int): Number of lines the hunk covers after the change
+
+    Returns:
+        str: The "@@ -a,b +c,d @@" header line
+    """
+    def format_range(count):
+        # A single line omits the count; an empty range points at the line before
+        if count == 1:
+            return f"{start + 1}"
+        return f"{start + 1 if count else start},{count}"
+
+    return f"@@ -{format_range(old_count)} +{format_range(new_count)} @@"
+
 @mcp.tool()
 def replace_lines(
     file_path: str,
@@ -624,11 +1137,11 @@ def replace_lines(
         dict: Success status, message, and unified diff showing changes
     """
     try:
-        # Read the original file
-        with open(file_path, 'r', encoding='utf-8') as f:
-            original_lines = f.readlines()
+        # Read the original file as bytes: only the edited window is decoded
+        with open(file_path, 'rb') as f:
+            data = f.read()
 
-        total_lines = len(original_lines)
+        total_lines = data.count(b'\n') + (bool(data) and not data.endswith(b'\n'))
 
         # Validate line numbers
         if start_line < 1 or start_line > total_lines + 1:
@@ -660,22 +1173,26 @@ def replace_lines(
             operation = "replace"
             end_idx = end_line
 
-        # Create the modified version
-        modified_lines = original_lines.copy()
-        modified_lines[start_idx:end_idx] = new_lines
-
-        # Generate unified diff (always show what changed/would change)
-        diff_lines = list(difflib.unified_diff(
-            original_lines,
-            modified_lines,
-            fromfile=f"{file_path} (before)",
-            tofile=f"{file_path} (after)",
-            lineterm=''
-        ))
-
-        # Remove the file headers and format nicely
-        if len(diff_lines) > 2:
-            diff_output = '\n'.join(diff_lines[2:])  # Skip the --- and +++ lines
+        # Locate the edited lines, plus the 3 lines of context the diff shows
+        ctx_start = max(start_idx - 3, 0)
+        ctx_end = min(end_idx + 3, total_lines)
+        ctx_start_off, start_off, end_off, ctx_end_off = _line_offsets(data, (ctx_start, start_idx, end_idx, ctx_end))
+        context_before = _split_lines(data[ctx_start_off:start_off].decode('utf-8'))
+        replaced = _split_lines(data[start_off:end_off].decode('utf-8'))
+        context_after = _split_lines(data[end_off:ctx_end_off].decode('utf-8'))
+
+        # Generate unified diff (always show what changed/would change). The
+        # edited range is known, so the single hunk is built directly
+        added = [line for line in new_lines if line]
+        if added != replaced:
+            diff_output = '\n'.join(
+                [_hunk_header(ctx_start, len(context_before) + len(replaced) + len(context_after),
+                              len(context_before) + len(added) + len(context_after))]
+                + [' ' + line for line in context_before]
+                + ['-' + line for line in replaced]
+                + ['+' + line for line in added]
+                + [' ' + line for line in context_after]
+            )
         else:
             diff_output = "No changes detected"
 
@@ -689,8 +1206,12 @@ def replace_lines(
             }
         else:
             # ACTUALLY MODIFY the file
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.writelines(modified_lines)
+            # Splice the new lines between the untouched head and tail
+            view = memoryview(data)
+            with open(file_path, 'wb') as f:
+                f.write(view[:start_off])
+                f.write(''.join(new_lines).encode('utf-8'))
+                f.write(view[end_off:])
 
             return {
                 "success": True,
@@ -713,9 +1234,16 @@ def initialize_workspace():
     # Get list of available projects
     projects = list_projects()
 
-    os.chdir(WORKDIR)
+    _chdir(WORKDIR)
     print(f"Setting '{WORKDIR}' as the active project")
 
+    # Spawn one throwaway shell so that the first shell_exec does not pay
+    # for loading the shell binary from disk
+    try:
+        _run("exit 0")
+    except OSError:
+        pass
+
 if __name__ == "__main__":
     try:
         # Log startup information
@@ -727,5 +1255,5 @@ if __name__ == "__main__":
         mcp.run(transport="streamable-http")
     except KeyboardInterrupt:
         print("\nShutting down MCP server...")
-        log_command("system", "shutdown", True)
+        log_command("system", "shutdown", result_success=True)
         sys.exit(0)